@@ -1,19 +1,62 @@
 # analytics.py
-import sqlite3, json, os
+import os, threading, queue, time, logging
 from datetime import datetime
+from db import Database, dumps as _dumps
 ANALYTICS_DB = os.getenv('ANALYTICS_DB','analytics.db')
-def _connect():
-    conn = sqlite3.connect(ANALYTICS_DB, check_same_thread=False); conn.row_factory = sqlite3.Row; return conn
+FLUSH_INTERVAL = 0.1  # seconds a batch may wait for more rows
+FLUSH_BATCH = 100
+LOG = logging.getLogger('analytics')
+INSERT_TURN_SQL = 'INSERT INTO conversations (session_id,turn,user_message,bot_reply,intent_json,interest_score,recommended_products,chosen_product,created_at) VALUES (?,?,?,?,?,?,?,?,?)'
+INSERT_QUERY_SQL = 'INSERT INTO query_log (query_text,params,duration_ms,created_at) VALUES (?,?,?,?)'
+RECENT_QUERIES_SQL = 'SELECT query_text,params,duration_ms,created_at FROM query_log ORDER BY id DESC LIMIT ?'
+CONVERSATIONS_SQL = 'SELECT {cols} FROM conversations ORDER BY id {direction} LIMIT ?'
+CONVERSATION_COLUMNS = ('id','session_id','turn','user_message','bot_reply','intent_json','interest_score','recommended_products','chosen_product','created_at')
+_DB = Database(ANALYTICS_DB)
+_LOCK, _get_conn, _acquire_reader = _DB.lock, _DB.writer, _DB.reader
+_LOG_Q = queue.Queue()
+_FLUSHER = None
 def init_db():
-    conn=_connect(); cur=conn.cursor()
-    cur.execute('''CREATE TABLE IF NOT EXISTS conversations (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, turn INTEGER, user_message TEXT, bot_reply TEXT, intent_json TEXT, interest_score INTEGER, recommended_products TEXT, chosen_product TEXT, created_at TEXT)''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS query_log (id INTEGER PRIMARY KEY AUTOINCREMENT, query_text TEXT, params TEXT, duration_ms REAL, created_at TEXT)''')
-    conn.commit(); conn.close()
+    with _LOCK:
+        cur=_get_conn().cursor()
+        cur.execute('''CREATE TABLE IF NOT EXISTS conversations (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, turn INTEGER, user_message TEXT, bot_reply TEXT, intent_json TEXT, interest_score INTEGER, recommended_products TEXT, chosen_product TEXT, created_at TEXT)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS query_log (id INTEGER PRIMARY KEY AUTOINCREMENT, query_text TEXT, params TEXT, duration_ms REAL, created_at TEXT)''')
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_conv_session ON conversations(session_id, id DESC)')
+def _write_batch(batch):
+    grouped={}
+    for sql,row in batch: grouped.setdefault(sql,[]).append(row)
+    with _DB.write_txn() as conn:
+        for sql,rows in grouped.items(): conn.executemany(sql,rows)
+def _flusher():
+    # one transaction (and one fsync) per batch of up to FLUSH_BATCH rows / FLUSH_INTERVAL seconds
+    while True:
+        batch=[_LOG_Q.get()]; deadline=time.monotonic()+FLUSH_INTERVAL
+        while len(batch)<FLUSH_BATCH:
+            remaining=deadline-time.monotonic()
+            if remaining<=0: break
+            try: batch.append(_LOG_Q.get(timeout=remaining))
+            except queue.Empty: break
+        try: _write_batch(batch)
+        except Exception as e: LOG.warning("Dropped %d analytics rows: %s", len(batch), e)
+        finally:
+            for _ in batch: _LOG_Q.task_done()
+def _enqueue(sql, row):
+    global _FLUSHER
+    if _FLUSHER is None:
+        with _LOCK:
+            if _FLUSHER is None:
+                _FLUSHER = threading.Thread(target=_flusher, name='analytics-flusher', daemon=True); _FLUSHER.start()
+    _LOG_Q.put((sql, row))
+def flush_logs():
+    # block until every queued row has been written (call on shutdown)
+    if _FLUSHER is not None: _LOG_Q.join()
 def log_turn(session_id, turn, user_message, bot_reply, score, intents, recommended=None, chosen=None):
-    conn=_connect(); cur=conn.cursor(); cur.execute('INSERT INTO conversations (session_id,turn,user_message,bot_reply,intent_json,interest_score,recommended_products,chosen_product,created_at) VALUES (?,?,?,?,?,?,?,?,?)',(session_id,turn,user_message,bot_reply,json.dumps(intents),score,json.dumps(recommended or []),chosen,datetime.utcnow().isoformat())); conn.commit(); conn.close()
+    _enqueue(INSERT_TURN_SQL,(session_id,turn,user_message,bot_reply,_dumps(intents),score,_dumps(recommended or []),chosen,datetime.utcnow().isoformat()))
 def log_query(query_text, params, duration_ms):
-    conn=_connect(); cur=conn.cursor(); cur.execute('INSERT INTO query_log (query_text,params,duration_ms,created_at) VALUES (?,?,?,?)',(query_text,json.dumps(params),duration_ms,datetime.utcnow().isoformat())); conn.commit(); conn.close()
+    _enqueue(INSERT_QUERY_SQL,(query_text,_dumps(params),duration_ms,datetime.utcnow().isoformat()))
 def fetch_recent_queries(limit=50):
-    conn=_connect(); cur=conn.cursor(); cur.execute('SELECT query_text,params,duration_ms,created_at FROM query_log ORDER BY id DESC LIMIT ?', (limit,)); rows=[dict(r) for r in cur.fetchall()]; conn.close(); return rows
-def fetch_conversations(limit=50):
-    conn=_connect(); cur=conn.cursor(); cur.execute('SELECT * FROM conversations ORDER BY id DESC LIMIT ?', (limit,)); rows=[dict(r) for r in cur.fetchall()]; conn.close(); return rows
+    with _acquire_reader() as conn: cur=conn.execute(RECENT_QUERIES_SQL, (limit,)); return [dict(r) for r in cur.fetchall()]
+def fetch_conversations(limit=50, descending=True, fields=None):
+    # fields: iterable of column names to project (unknown names are ignored); None selects all
+    cols = '*' if fields is None else ','.join(c for c in CONVERSATION_COLUMNS if c in set(fields)) or 'id'
+    sql = CONVERSATIONS_SQL.format(cols=cols, direction='DESC' if descending else 'ASC')
+    with _acquire_reader() as conn: cur=conn.execute(sql, (limit,)); return [dict(r) for r in cur.fetchall()]
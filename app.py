@@ -1,44 +1,54 @@
 # app.py
 import os
+import asyncio
 from dotenv import load_dotenv
 load_dotenv()
 
 import logging
-import sqlite3
-import json
 import uuid
 import time
+import threading
+from concurrent.futures import Future
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
+from cachetools import LRUCache
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # local modules (make sure these files exist in the project)
 from convo import update_context_and_score, _init_context
-from recommender import recommend_by_preferences, collaborative_recommend
-from analytics import init_db, log_turn, fetch_recent_queries, fetch_conversations
-from convo_llm import parse_nlu_with_llm, generate_reply_with_llm
+from recommender import LIST_FIELDS, recommend_by_preferences, matches_preferences, collaborative_recommend, search_products, fetch_products_by_ids, init_products_db, sync_product_tags, _acquire_reader, _write_txn, _parse_row, _dumps
+from analytics import init_db, log_turn, flush_logs, fetch_recent_queries, fetch_conversations
+from convo_llm import parse_nlu_with_llm, generate_reply_with_llm, stream_reply_with_llm
 
 LOG = logging.getLogger("foodiebot")
 logging.basicConfig(level=logging.INFO)
 
-# DB path (can be overridden via .env)
-DB = os.getenv("FOODIE_DB", "foodie_products.db")
-
-app = FastAPI(title="FoodieBot API (Groq-enabled)")
+# orjson encodes the list-heavy responses (/search, /analytics/*) much faster than stdlib json
+app = FastAPI(title="FoodieBot API (Groq-enabled)", default_response_class=ORJSONResponse if orjson else JSONResponse)
 init_db()
+init_products_db()
 
-# in-memory session contexts
-CONTEXTS: Dict[str, Dict[str, Any]] = {}
+@app.on_event("shutdown")
+def _flush_analytics():
+    # analytics rows are written by a background batcher; drain it before exit
+    flush_logs()
 
-# -----------------------
-# Utility / DB helpers
-# -----------------------
-def _connect():
-    conn = sqlite3.connect(DB, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+# in-memory session contexts (bounded LRU; least recently used sessions are evicted)
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+CONTEXTS: LRUCache = LRUCache(maxsize=MAX_SESSIONS)
+CTX_LOCK = threading.Lock()
+# /chat responses by client_request_id, registered before any work starts so a resent message
+# (finished or still running) is answered once and scored once; values are concurrent.futures.Future
+RECENT_REPLIES: LRUCache = LRUCache(maxsize=1024)
+DEDUPE_WAIT = 60.0  # seconds a duplicate waits for the original request's reply
 
 # -----------------------
 # Request models
@@ -47,6 +57,8 @@ class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
     product_id: Optional[str] = None
+    stream: bool = False  # reply as text/event-stream instead of one JSON body
+    client_request_id: Optional[str] = None  # retries with the same id get the first reply back
 
 class ProductCreate(BaseModel):
     product_id: Optional[str] = None
@@ -77,15 +89,49 @@ def root():
 # -----------------------
 # Chat endpoint (robust)
 # -----------------------
+PREFETCH_LIMIT = 20  # top-ranked products fetched while the NLU call is in flight
+
 @app.post("/chat")
-def chat(req: ChatRequest):
-    sid = req.session_id or str(uuid.uuid4())
-    context = CONTEXTS.get(sid) or _init_context(sid)
-    CONTEXTS[sid] = context
+async def chat(req: ChatRequest):
+    rid = req.client_request_id
+    if not rid:
+        return await _chat_turn(req)
+    with CTX_LOCK:
+        reply_future = RECENT_REPLIES.get(rid)
+        is_duplicate = reply_future is not None
+        if not is_duplicate:
+            reply_future = RECENT_REPLIES[rid] = Future()
+    if is_duplicate:
+        try:
+            done = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(reply_future)), DEDUPE_WAIT)
+        except Exception as e:
+            LOG.warning("Duplicate chat request %s not answered: %s", rid, e)
+            raise HTTPException(status_code=409, detail="The original request with this client_request_id did not complete")
+        if req.stream:
+            return StreamingResponse(iter([_sse({"type": "delta", "text": done.get("reply") or ""}), _sse({"type": "done", **done})]), media_type="text/event-stream")
+        return done
+    try:
+        return await _chat_turn(req, reply_future)
+    except BaseException as e:
+        # let the id be retried, and release anyone waiting on it
+        with CTX_LOCK:
+            RECENT_REPLIES.pop(rid, None)
+        if not reply_future.done():
+            reply_future.set_exception(e)
+        raise
 
-    # 1) NLU parse (Groq or fallback) - protect with try/except
+async def _chat_turn(req: ChatRequest, reply_future: Optional[Future] = None):
+    sid = req.session_id or uuid.uuid4().hex
+    with CTX_LOCK:
+        context = CONTEXTS.get(sid) or _init_context(sid)
+        CONTEXTS[sid] = context
+
+    # 1) NLU parse (Groq or fallback) - protect with try/except; the unfiltered top products
+    #    are prefetched concurrently so the DB read hides behind the Groq round-trip
+    nlu_task = asyncio.create_task(asyncio.to_thread(parse_nlu_with_llm, req.message))
+    prefetch_task = asyncio.create_task(asyncio.to_thread(recommend_by_preferences, limit=PREFETCH_LIMIT))
     try:
-        nlu_slots = parse_nlu_with_llm(req.message)
+        nlu_slots = await nlu_task
     except Exception as e:
         LOG.warning("NLU parse failed: %s", e)
         # minimal fallback
@@ -94,7 +140,8 @@ def chat(req: ChatRequest):
     # 2) update context & score
     try:
         context, delta, total_score, _ = update_context_and_score(context, req.message)
-        CONTEXTS[sid] = context
+        with CTX_LOCK:
+            CONTEXTS[sid] = context
     except Exception as e:
         LOG.warning("Context update failed: %s", e)
         delta, total_score = 0, context.get("accumulated_score", 0)
@@ -102,38 +149,59 @@ def chat(req: ChatRequest):
     # 3) fetch candidate products (recommendation)
     products: List[Dict[str, Any]] = []
     try:
-        products = recommend_by_preferences(
+        prefetched = await prefetch_task
+    except Exception as e:
+        LOG.warning("Recommend prefetch failed: %s", e)
+        prefetched = None
+    try:
+        prefs = dict(
             mood=nlu_slots.get("mood") if isinstance(nlu_slots, dict) else None,
             budget=nlu_slots.get("budget") if isinstance(nlu_slots, dict) else None,
             dietary=nlu_slots.get("dietary") if isinstance(nlu_slots, dict) else None,
             nutrient=nlu_slots.get("nutrient") if isinstance(nlu_slots, dict) else None,
-            limit=6
         )
+        # the prefetch shares the ranking, so its filtered head equals the filtered query's head;
+        # only go back to the DB when too few prefetched rows match and the catalog wasn't exhausted
+        products = [p for p in (prefetched or []) if matches_preferences(p, **prefs)][:6]
+        if len(products) < 6 and (prefetched is None or len(prefetched) >= PREFETCH_LIMIT):
+            products = await asyncio.to_thread(recommend_by_preferences, limit=6, **prefs)
     except Exception as e:
         LOG.warning("Recommend fetch failed: %s", e)
         products = []
 
-    # 4) attempt to generate a reply via Groq wrapper (with fallback protected)
+    # 4) streaming clients get the scoring metadata immediately and the reply as it is generated
+    meta = {"session_id": sid, "interest_score": total_score, "score_delta": delta, "nlu_slots": nlu_slots}
+    if req.client_request_id:
+        meta["client_request_id"] = req.client_request_id
+    if req.stream:
+        return StreamingResponse(_chat_events(meta, context, req.message, products, reply_future), media_type="text/event-stream")
+
+    # 5) attempt to generate a reply via Groq wrapper (with fallback protected)
     try:
-        reply_obj = generate_reply_with_llm(context, req.message, products[:4], total_score)
+        reply_obj = await asyncio.to_thread(generate_reply_with_llm, context, req.message, products[:4], total_score)
     except Exception as e:
         LOG.warning("Reply generation failed: %s", e)
-        # safe fallback reply
-        if products:
-            p = products[0]
-            reply_obj = {"reply": f"I found {p.get('name')} for ${float(p.get('price') or 0):.2f}. Want details?", "suggested":[p.get("product_id")], "mention_spice": bool(p.get("spice_level")), "debug":"fallback"}
-        else:
-            reply_obj = {"reply":"Tell me more about your mood, budget, or dietary needs.", "suggested": [], "mention_spice": False, "debug":"fallback_none"}
-
-    # 5) log the turn (analytics) - non-blocking
+        reply_obj = _fallback_reply_obj(products)
+
+    return _finish_turn(meta, context, req.message, products, reply_obj, reply_future)
+
+def _fallback_reply_obj(products: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # safe fallback reply
+    if products:
+        p = products[0]
+        return {"reply": f"I found {p.get('name')} for ${float(p.get('price') or 0):.2f}. Want details?", "suggested":[p.get("product_id")], "mention_spice": bool(p.get("spice_level")), "debug":"fallback"}
+    return {"reply":"Tell me more about your mood, budget, or dietary needs.", "suggested": [], "mention_spice": False, "debug":"fallback_none"}
+
+def _finish_turn(meta: Dict[str, Any], context: Dict[str, Any], message: str, products: List[Dict[str, Any]], reply_obj: Dict[str, Any], reply_future: Optional[Future] = None) -> Dict[str, Any]:
+    # log the turn (analytics) - non-blocking
     try:
-        turn_num = len([h for h in context.get("history", []) if h.get("role") == "user"])
+        turn_num = context.get("user_turns", 0)
         log_turn(
-            session_id=sid,
+            session_id=meta["session_id"],
             turn=turn_num,
-            user_message=req.message,
+            user_message=message,
             bot_reply=reply_obj.get("reply"),
-            score=total_score,
+            score=meta["interest_score"],
             intents=context.get("intents", {}),
             recommended=[p.get("product_id") for p in products[:6]],
             chosen=None
@@ -141,22 +209,57 @@ def chat(req: ChatRequest):
     except Exception as e:
         LOG.warning("Analytics log failed: %s", e)
 
-    return {
-        "session_id": sid,
+    result = {
+        **meta,
         "reply": reply_obj.get("reply"),
-        "interest_score": total_score,
-        "score_delta": delta,
-        "nlu_slots": nlu_slots,
         "suggested": reply_obj.get("suggested", []),
         "debug": reply_obj.get("debug", "")
     }
+    if reply_future is not None and not reply_future.done():
+        reply_future.set_result(result)
+    return result
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"data: {_dumps(event)}\n\n"
+
+def _chat_events(meta: Dict[str, Any], context: Dict[str, Any], message: str, products: List[Dict[str, Any]], reply_future: Optional[Future] = None):
+    """Server-sent events for a streamed /chat turn: meta, reply deltas, then the full response."""
+    # sync generator: StreamingResponse iterates it in the threadpool, so the blocking Groq stream is fine
+    reply_obj, streamed, finished = None, "", False
+    try:
+        yield _sse({"type": "meta", **meta})
+        try:
+            for kind, value in stream_reply_with_llm(context, message, products[:4], meta["interest_score"]):
+                if kind == "delta":
+                    streamed += value
+                    yield _sse({"type": "delta", "text": value})
+                else:
+                    reply_obj = value
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            LOG.warning("Reply stream failed: %s", e)
+        if reply_obj is None:
+            reply_obj = _fallback_reply_obj(products)
+            yield _sse({"type": "delta", "text": reply_obj["reply"]})
+        result = _finish_turn(meta, context, message, products, reply_obj, reply_future)
+        finished = True
+        yield _sse({"type": "done", **result})
+    finally:
+        # the context was already scored; if the client went away mid-stream (Starlette drops the
+        # generator, closing it) still log the turn and answer retries of this id with what was sent
+        if not finished:
+            if reply_obj is None:
+                reply_obj = {"reply": streamed, "suggested": [], "mention_spice": False, "debug": "stream_aborted"} if streamed else _fallback_reply_obj(products)
+            _finish_turn(meta, context, message, products, reply_obj, reply_future)
 
 # -----------------------
 # Recommend from context
 # -----------------------
 @app.get("/recommend_from_context")
 def recommend_from_context(session_id: str, limit: int = 6):
-    context = CONTEXTS.get(session_id)
+    with CTX_LOCK:
+        context = CONTEXTS.get(session_id)
     if not context:
         raise HTTPException(status_code=404, detail="Session not found")
     intents = context.get("intents", {})
@@ -175,7 +278,7 @@ def recommend_from_context(session_id: str, limit: int = 6):
     try:
         log_turn(
             session_id=session_id,
-            turn=len([h for h in context.get("history", []) if h.get("role") == "user"]),
+            turn=context.get("user_turns", 0),
             user_message="[SYSTEM] recommend_from_context",
             bot_reply=f"{len(recs)} recommended",
             score=context.get("accumulated_score"),
@@ -192,27 +295,36 @@ def recommend_from_context(session_id: str, limit: int = 6):
 # -----------------------
 @app.get("/product/{product_id}")
 def get_product(product_id: str):
-    conn = _connect(); cur = conn.cursor()
-    cur.execute("SELECT * FROM products WHERE product_id=?", (product_id,))
-    r = cur.fetchone(); conn.close()
+    with _acquire_reader() as conn:
+        r = conn.execute("SELECT * FROM products WHERE product_id=?", (product_id,)).fetchone()
     if not r:
         raise HTTPException(status_code=404, detail="Product not found")
-    item = dict(r)
-    for f in ("ingredients","dietary_tags","mood_tags","allergens"):
-        if item.get(f):
-            try:
-                item[f] = json.loads(item[f])
-            except Exception:
-                pass
-    return item
+    return _parse_row(r)
+
+def _parse_fields(fields: Optional[str]):
+    # default: everything but ingredients/allergens; "*" for all columns; else a comma-separated list
+    if fields is None:
+        return LIST_FIELDS
+    if fields.strip() == "*":
+        return None
+    return frozenset(f.strip() for f in fields.split(",") if f.strip())
+
+# -----------------------
+# Batch product detail (one call for a list of ids)
+# -----------------------
+@app.get("/products")
+def get_products(ids: str = Query(..., min_length=1), fields: Optional[str] = None):
+    id_list = [i.strip() for i in ids.split(",") if i.strip()]
+    rows = fetch_products_by_ids(id_list, fields=_parse_fields(fields))
+    return {"count": len(rows), "results": rows}
 
 # -----------------------
 # Simple recommend endpoint
 # -----------------------
 @app.get("/recommend")
-def recommend(mood: Optional[str] = None, budget: Optional[float] = None, limit: int = 6):
+def recommend(mood: Optional[str] = None, budget: Optional[float] = None, limit: int = 6, fields: Optional[str] = None):
     try:
-        recs = recommend_by_preferences(mood=mood, budget=budget, limit=limit)
+        recs = recommend_by_preferences(mood=mood, budget=budget, limit=limit, fields=_parse_fields(fields))
     except Exception as e:
         LOG.warning("Recommend endpoint failed: %s", e)
         recs = []
@@ -222,24 +334,18 @@ def recommend(mood: Optional[str] = None, budget: Optional[float] = None, limit:
 # Search (name/description)
 # -----------------------
 @app.get("/search")
-def search(q: str = Query(..., min_length=1), limit: int = 10):
-    conn = _connect(); cur = conn.cursor()
-    cur.execute("SELECT * FROM products WHERE name LIKE ? OR description LIKE ? LIMIT ?", (f"%{q}%", f"%{q}%", limit))
-    rows = [dict(r) for r in cur.fetchall()]; conn.close()
-    for r in rows:
-        for f in ("ingredients","dietary_tags","mood_tags","allergens"):
-            if r.get(f):
-                try: r[f] = json.loads(r[f])
-                except: pass
+def search(q: str = Query(..., min_length=1), limit: int = 10, fields: Optional[str] = None):
+    rows = search_products(q, limit=limit, fields=_parse_fields(fields))
     return {"count": len(rows), "results": rows}
 
 # -----------------------
 # Analytics endpoints
 # -----------------------
 @app.get("/analytics/conversations")
-def api_fetch_conversations(limit: int = 50):
+def api_fetch_conversations(limit: int = 50, order: str = Query("id.desc", pattern="^id\\.(asc|desc)$"), fields: Optional[str] = None):
+    # rows come back already ordered and projected so clients don't re-sort or drop columns
     try:
-        rows = fetch_conversations(limit=limit)
+        rows = fetch_conversations(limit=limit, descending=order.endswith("desc"), fields=None if fields is None else [f.strip() for f in fields.split(",")])
         return rows
     except Exception as e:
         LOG.exception("Failed fetching conversations: %s", e)
@@ -257,86 +363,100 @@ def api_recent_queries(limit: int = 50):
 # -----------------------
 # Admin CRUD (create / update / delete)
 # -----------------------
-def _db_conn():
-    conn = sqlite3.connect(DB, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+INSERT_PRODUCT_SQL = """
+    INSERT INTO products (
+        product_id, name, category, description, ingredients, price, calories, prep_time,
+        dietary_tags, mood_tags, allergens, popularity_score, chef_special, limited_time,
+        spice_level, image_url, image_prompt, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
-@app.post("/admin/products", tags=["admin"])
-def admin_create_product(payload: ProductCreate):
-    pid = payload.product_id or f"P{int(time.time()*1000) % 1000000}"
-    conn = _db_conn(); cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO products (
-            product_id, name, category, description, ingredients, price, calories, prep_time,
-            dietary_tags, mood_tags, allergens, popularity_score, chef_special, limited_time,
-            spice_level, image_url, image_prompt, created_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+def _product_insert_row(pid: str, payload: ProductCreate, created_at: str):
+    return (
         pid,
         payload.name,
         payload.category,
         payload.description,
-        json.dumps(payload.ingredients or []),
+        _dumps(payload.ingredients or []),
         float(payload.price),
         int(payload.calories) if payload.calories is not None else None,
         payload.prep_time,
-        json.dumps(payload.dietary_tags or []),
-        json.dumps(payload.mood_tags or []),
-        json.dumps(payload.allergens or []),
+        _dumps(payload.dietary_tags or []),
+        _dumps(payload.mood_tags or []),
+        _dumps(payload.allergens or []),
         int(payload.popularity_score or 50),
         1 if payload.chef_special else 0,
         1 if payload.limited_time else 0,
         int(payload.spice_level or 0),
         payload.image_url,
         payload.image_prompt,
-        datetime.utcnow().isoformat()
-    ))
-    conn.commit(); conn.close()
+        created_at
+    )
+
+@app.post("/admin/products", tags=["admin"])
+def admin_create_product(payload: ProductCreate):
+    pid = payload.product_id or f"P{int(time.time()*1000) % 1000000}"
+    with _write_txn() as conn:
+        conn.execute(INSERT_PRODUCT_SQL, _product_insert_row(pid, payload, datetime.utcnow().isoformat()))
+        sync_product_tags(conn, pid, payload.mood_tags, payload.dietary_tags, payload.allergens)
     return {"status": "created", "product_id": pid}
 
+@app.post("/admin/products/bulk", tags=["admin"])
+def admin_create_products_bulk(payloads: List[ProductCreate]):
+    # one transaction (one fsync) for the whole batch instead of one per product
+    base = int(time.time()*1000)
+    created_at = datetime.utcnow().isoformat()
+    pids = [p.product_id or f"P{(base + i) % 1000000}" for i, p in enumerate(payloads)]
+    with _write_txn() as conn:
+        conn.executemany(INSERT_PRODUCT_SQL, [_product_insert_row(pid, p, created_at) for pid, p in zip(pids, payloads)])
+        for pid, p in zip(pids, payloads):
+            sync_product_tags(conn, pid, p.mood_tags, p.dietary_tags, p.allergens)
+    return {"status": "created", "count": len(pids), "product_ids": pids}
+
 @app.put("/admin/products/{product_id}", tags=["admin"])
 def admin_update_product(product_id: str, payload: ProductCreate):
-    conn = _db_conn(); cur = conn.cursor()
-    cur.execute("SELECT product_id FROM products WHERE product_id=?", (product_id,))
-    if not cur.fetchone():
-        conn.close(); raise HTTPException(status_code=404, detail="Product not found")
-    cur.execute("""
-        UPDATE products SET
-            name=?, category=?, description=?, ingredients=?, price=?, calories=?, prep_time=?,
-            dietary_tags=?, mood_tags=?, allergens=?, popularity_score=?, chef_special=?, limited_time=?,
-            spice_level=?, image_url=?, image_prompt=?
-        WHERE product_id=?
-    """, (
-        payload.name,
-        payload.category,
-        payload.description,
-        json.dumps(payload.ingredients or []),
-        float(payload.price),
-        int(payload.calories) if payload.calories is not None else None,
-        payload.prep_time,
-        json.dumps(payload.dietary_tags or []),
-        json.dumps(payload.mood_tags or []),
-        json.dumps(payload.allergens or []),
-        int(payload.popularity_score or 50),
-        1 if payload.chef_special else 0,
-        1 if payload.limited_time else 0,
-        int(payload.spice_level or 0),
-        payload.image_url,
-        payload.image_prompt,
-        product_id
-    ))
-    conn.commit(); conn.close()
+    with _write_txn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT product_id FROM products WHERE product_id=?", (product_id,))
+        if not cur.fetchone():
+            raise HTTPException(status_code=404, detail="Product not found")
+        cur.execute("""
+            UPDATE products SET
+                name=?, category=?, description=?, ingredients=?, price=?, calories=?, prep_time=?,
+                dietary_tags=?, mood_tags=?, allergens=?, popularity_score=?, chef_special=?, limited_time=?,
+                spice_level=?, image_url=?, image_prompt=?
+            WHERE product_id=?
+        """, (
+            payload.name,
+            payload.category,
+            payload.description,
+            _dumps(payload.ingredients or []),
+            float(payload.price),
+            int(payload.calories) if payload.calories is not None else None,
+            payload.prep_time,
+            _dumps(payload.dietary_tags or []),
+            _dumps(payload.mood_tags or []),
+            _dumps(payload.allergens or []),
+            int(payload.popularity_score or 50),
+            1 if payload.chef_special else 0,
+            1 if payload.limited_time else 0,
+            int(payload.spice_level or 0),
+            payload.image_url,
+            payload.image_prompt,
+            product_id
+        ))
+        sync_product_tags(conn, product_id, payload.mood_tags, payload.dietary_tags, payload.allergens)
     return {"status": "updated", "product_id": product_id}
 
 @app.delete("/admin/products/{product_id}", tags=["admin"])
 def admin_delete_product(product_id: str):
-    conn = _db_conn(); cur = conn.cursor()
-    cur.execute("SELECT product_id FROM products WHERE product_id=?", (product_id,))
-    if not cur.fetchone():
-        conn.close(); raise HTTPException(status_code=404, detail="Product not found")
-    cur.execute("DELETE FROM products WHERE product_id=?", (product_id,))
-    conn.commit(); conn.close()
+    with _write_txn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT product_id FROM products WHERE product_id=?", (product_id,))
+        if not cur.fetchone():
+            raise HTTPException(status_code=404, detail="Product not found")
+        cur.execute("DELETE FROM products WHERE product_id=?", (product_id,))
+        cur.execute("DELETE FROM product_tags WHERE product_id=?", (product_id,))
     return {"status": "deleted", "product_id": product_id}
 
 # -----------------------
@@ -357,6 +477,8 @@ def collab(product_id: str, limit: int = 5):
 @app.get("/debug/sessions")
 def debug_sessions():
     out = {}
-    for sid, ctx in CONTEXTS.items():
+    with CTX_LOCK:
+        sessions = list(CONTEXTS.items())
+    for sid, ctx in sessions:
         out[sid] = {"intents": ctx.get("intents"), "accumulated_score": ctx.get("accumulated_score"), "history_len": len(ctx.get("history", []))}
     return out
@@ -1,36 +1,72 @@
 # convo.py (simplified context + scoring)
 import re, uuid
 from typing import Optional
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 ENGAGEMENT_FACTORS = {'specific_preferences':15,'dietary_restrictions':10,'budget_mention':5,'mood_indication':20,'question_asking':10,'enthusiasm_words':8,'price_inquiry':25,'order_intent':30,'nutrient_preference':12}
 NEGATIVE_FACTORS = {'hesitation':-10,'budget_concern':-15,'dietary_conflict':-20,'rejection':-25,'delay_response':-5}
 DIETARY_KEYWORDS = ["vegan","vegetarian","gluten_free","dairy_free","nut_free"]
 
+MOODS = ["adventurous","comfort","healthy","indulgent","quick","refreshing","cozy","party"]
+SPICY_WORDS = ["spicy","hot","chili","jalape"]
+ORDER_WORDS = ["order","add to cart","i'll take","i will take","buy"]
+ENTHUSIASM_WORDS = ["love","perfect","amazing","delicious"]
+_KEYWORD_GROUPS = (('dietary',DIETARY_KEYWORDS),('spicy',SPICY_WORDS),('order',ORDER_WORDS),('enthusiasm',ENTHUSIASM_WORDS),('mood',MOODS))
+# compiled once at import; alternations keep the original substring semantics in a single scan
+_BUDGET_UNDER = re.compile(r"under\s*\$?\s*(\d+(?:\.\d+)?)")
+_BUDGET_DOLLAR = re.compile(r"\$\s*(\d+(?:\.\d+)?)")
+_SPICY_RE = re.compile("|".join(map(re.escape, SPICY_WORDS)))
+_ORDER_RE = re.compile("|".join(map(re.escape, ORDER_WORDS)))
+_ENTHUSIASM_RE = re.compile("|".join(map(re.escape, ENTHUSIASM_WORDS)))
+_MOOD_RE = re.compile("|".join(map(re.escape, MOODS)))
+
+def _build_automaton():
+    # one Aho-Corasick pass finds every keyword of every group; None without pyahocorasick
+    if ahocorasick is None: return None
+    A = ahocorasick.Automaton()
+    for group, words in _KEYWORD_GROUPS:
+        for w in words: A.add_word(w, (group, w))
+    A.make_automaton()
+    return A
+_AUTOMATON = _build_automaton()
+
 def _extract_budget(txt):
-    import re
-    m = re.search(r"under\s*\$?\s*(\d+(?:\.\d+)?)", txt)
+    m = _BUDGET_UNDER.search(txt) or _BUDGET_DOLLAR.search(txt)
     if m: return float(m.group(1))
-    m2 = re.search(r"\$\s*(\d+(?:\.\d+)?)", txt)
-    if m2: return float(m2.group(1))
     return None
 
+def _scan_keywords(txt):
+    # {group: [matched words in text order]}
+    hits = {}
+    if _AUTOMATON is not None:
+        for _, (group, word) in _AUTOMATON.iter(txt): hits.setdefault(group, []).append(word)
+        return hits
+    dietary = [d for d in DIETARY_KEYWORDS if d in txt]
+    if dietary: hits['dietary']=dietary
+    for group, rx in (('spicy',_SPICY_RE),('order',_ORDER_RE),('enthusiasm',_ENTHUSIASM_RE),('mood',_MOOD_RE)):
+        m = rx.search(txt)
+        if m: hits[group]=[m.group(0)]
+    return hits
+
 def simple_nlu(text: str) -> dict:
     txt = (text or "").lower()
     out = {}
     b = _extract_budget(txt)
     if b: out['budget']=b
-    for d in DIETARY_KEYWORDS:
-        if d in txt: out.setdefault('dietary',[]).append(d)
-    if any(w in txt for w in ["spicy","hot","chili","jalape"]): out['spicy']=True
-    if any(w in txt for w in ["order","add to cart","i'll take","i will take","buy"]): out['order']=True
-    if any(w in txt for w in ["love","perfect","amazing","delicious"]): out['enthusiasm']=True
+    hits = _scan_keywords(txt)
+    if 'dietary' in hits: out['dietary']=[d for d in DIETARY_KEYWORDS if d in hits['dietary']]
+    if 'spicy' in hits: out['spicy']=True
+    if 'order' in hits: out['order']=True
+    if 'enthusiasm' in hits: out['enthusiasm']=True
     if '?' in txt: out['question']=True
-    for mood in ["adventurous","comfort","healthy","indulgent","quick","refreshing","cozy","party"]:
-        if mood in txt: out['mood']=mood; break
+    if 'mood' in hits: out['mood']=hits['mood'][0]
     return out
 
 def _init_context(session_id: Optional[str]=None):
-    if session_id is None: session_id=str(uuid.uuid4())
-    return {'session_id':session_id,'history':[],'intents':{},'accumulated_score':0,'seen_intents':set()}
+    if session_id is None: session_id=uuid.uuid4().hex
+    return {'session_id':session_id,'history':[],'intents':{},'accumulated_score':0,'seen_intents':set(),'user_turns':0}
 
 def update_context_and_score(context, text, product_tags=None):
     if context is None: context=_init_context()
@@ -44,6 +80,7 @@ def update_context_and_score(context, text, product_tags=None):
     if 'order' in nlu: score_delta += ENGAGEMENT_FACTORS['order_intent']
     if 'spicy' in nlu: score_delta += ENGAGEMENT_FACTORS['specific_preferences']
     context['history'].append({'role':'user','text':text,'nlu':nlu,'score_delta':score_delta})
+    context['user_turns'] = context.get('user_turns',0) + 1
     context['accumulated_score'] = max(0,min(100, context.get('accumulated_score',0) + score_delta))
     return context, score_delta, context['accumulated_score'], nlu
 
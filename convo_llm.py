@@ -7,13 +7,16 @@ FoodieBot Conversational Intelligence with Groq SDK.
 """
 
 import os, json, re, logging
-from typing import Dict, Any, List, Optional
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 try:
     from groq import Groq
 except ImportError:
     Groq = None
 
+from db import dumps as _dumps
+
 LOG = logging.getLogger("convo_llm")
 LOG.setLevel(logging.INFO)
 
@@ -22,6 +25,8 @@ LOG.setLevel(logging.INFO)
 # -------------------
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+NLU_CACHE_SIZE = int(os.getenv("NLU_CACHE_SIZE", "4096"))
+NLU_CACHE_KEY_MAX = 200  # normalized messages longer than this bypass the NLU cache
 client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY and Groq else None
 
 # -------------------
@@ -56,7 +61,27 @@ Return ONLY valid JSON with keys:
 def _extract_json(text: str) -> Optional[str]:
     if not text or "{" not in text:
         return None
+    # single pass: return the first balanced {...}, ignoring braces inside strings
     start = text.find("{")
+    depth, in_str, escaped = 0, False, False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i+1]
+    # unbalanced (e.g. truncated output): fall back to the widest candidate
     end = text.rfind("}")
     if start >= 0 and end > start:
         return text[start:end+1]
@@ -82,15 +107,16 @@ def _safe_parse_json(text: str) -> Dict[str, Any]:
             LOG.warning("Cleanup JSON parse failed: %s", e2)
             return {}
 
-def _safe_json(obj):
-    """Recursively convert sets to lists for JSON serialization."""
-    if isinstance(obj, set):
-        return list(obj)
-    if isinstance(obj, dict):
-        return {k: _safe_json(v) for k, v in obj.items()}
-    if isinstance(obj, (list, tuple)):
-        return [_safe_json(x) for x in obj]
-    return obj
+def _context_json(context: Dict[str, Any]) -> str:
+    """Serialize a session context for the reply prompt, reusing cached per-turn history JSON."""
+    # history is append-only: encode each turn once, re-encode only the small top-level fields
+    history = context.get("history") or []
+    cache = context.setdefault("_history_json", [])
+    if len(cache) > len(history):
+        cache.clear()
+    cache.extend(_dumps(h) for h in history[len(cache):])
+    head = _dumps({k: v for k, v in context.items() if k != "history" and not k.startswith("_")})
+    return head[:-1] + ("," if len(head) > 2 else "") + '"history":[' + ",".join(cache) + "]}"
 
 def _call_groq(prompt: str, max_tokens: int = 300, temperature: float = 0.0) -> str:
     if not client:
@@ -105,33 +131,44 @@ def _call_groq(prompt: str, max_tokens: int = 300, temperature: float = 0.0) ->
     )
     return resp.choices[0].message.content
 
+def _parse_nlu(message: str) -> Dict[str, Any]:
+    # raises on Groq failure so only successful parses are cached
+    prompt = NLU_PROMPT.format(message=message.replace('"','\\"'))
+    out = _call_groq(prompt, max_tokens=200, temperature=0.0)
+    jtxt = _extract_json(out) or out
+    parsed = _safe_parse_json(jtxt)
+    return {
+        "mood": parsed.get("mood"),
+        "budget": _to_float(parsed.get("budget")),
+        "dietary": parsed.get("dietary") or [],
+        "nutrient": parsed.get("nutrient"),
+        "spicy": bool(parsed.get("spicy")),
+        "question": bool(parsed.get("question")),
+        "order": bool(parsed.get("order")),
+        "enthusiasm": bool(parsed.get("enthusiasm")),
+        "free_text": parsed.get("free_text")
+    }
+
+_parse_nlu_cached = lru_cache(maxsize=NLU_CACHE_SIZE)(_parse_nlu)
+
 # -------------------
 # Public
 # -------------------
 def parse_nlu_with_llm(message: str) -> Dict[str, Any]:
     try:
-        prompt = NLU_PROMPT.format(message=message.replace('"','\\"'))
-        out = _call_groq(prompt, max_tokens=200, temperature=0.0)
-        jtxt = _extract_json(out) or out
-        parsed = _safe_parse_json(jtxt)
-        return {
-            "mood": parsed.get("mood"),
-            "budget": _to_float(parsed.get("budget")),
-            "dietary": parsed.get("dietary") or [],
-            "nutrient": parsed.get("nutrient"),
-            "spicy": bool(parsed.get("spicy")),
-            "question": bool(parsed.get("question")),
-            "order": bool(parsed.get("order")),
-            "enthusiasm": bool(parsed.get("enthusiasm")),
-            "free_text": parsed.get("free_text") or message
-        }
+        # repeated phrasings ("vegan options", "spicy under $10") skip the Groq round-trip
+        # longer messages are rarely repeated; they go to Groq unchanged and uncached
+        key = " ".join(message.lower().split())
+        slots = dict(_parse_nlu_cached(key) if len(key) <= NLU_CACHE_KEY_MAX else _parse_nlu(message))
+        if isinstance(slots["dietary"], list): slots["dietary"] = list(slots["dietary"])
+        slots["free_text"] = slots["free_text"] or message
+        return slots
     except Exception as e:
         LOG.warning("Groq NLU failed — fallback. Error: %s", e)
         return _fallback_nlu(message)
 
-def generate_reply_with_llm(context: Dict[str,Any], user_message: str,
-                            products: List[Dict[str,Any]], interest_score: int) -> Dict[str,Any]:
-    safe_products = [
+def _safe_products(products: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
+    return [
         {
             "product_id": p.get("product_id"),
             "name": p.get("name"),
@@ -141,35 +178,116 @@ def generate_reply_with_llm(context: Dict[str,Any], user_message: str,
         }
         for p in (products or [])[:4]
     ]
-    try:
-        prompt = REPLY_PROMPT.format(
-            context=json.dumps(_safe_json(context)),
-            message=user_message.replace('"','\\"'),
-            products=json.dumps(_safe_json(safe_products)),
-            score=interest_score
-        )
-        out = _call_groq(prompt, max_tokens=300, temperature=0.2)
-        jtxt = _extract_json(out) or out
 
-        parsed = _safe_parse_json(jtxt)
-        if not parsed:  # if still broken, wrap text as reply
-            return {
-                "reply": out.strip(),
-                "suggested": [],
-                "mention_spice": False,
-                "debug": "wrapped_text"
-            }
+def _reply_prompt(context, user_message, safe_products, interest_score) -> str:
+    return REPLY_PROMPT.format(
+        context=_context_json(context),
+        message=user_message.replace('"','\\"'),
+        products=_dumps(safe_products),
+        score=interest_score
+    )
+
+def _finish_reply(out: str) -> Dict[str,Any]:
+    jtxt = _extract_json(out) or out
 
+    parsed = _safe_parse_json(jtxt)
+    if not parsed:  # if still broken, wrap text as reply
         return {
-            "reply": parsed.get("reply","").strip(),
-            "suggested": parsed.get("suggested") or [],
-            "mention_spice": bool(parsed.get("mention_spice", False)),
-            "debug": parsed.get("debug","groq")
+            "reply": out.strip(),
+            "suggested": [],
+            "mention_spice": False,
+            "debug": "wrapped_text"
         }
+
+    return {
+        "reply": parsed.get("reply","").strip(),
+        "suggested": parsed.get("suggested") or [],
+        "mention_spice": bool(parsed.get("mention_spice", False)),
+        "debug": parsed.get("debug","groq")
+    }
+
+_REPLY_KEY = re.compile(r'"reply"\s*:\s*"')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+def _partial_reply(raw: str) -> str:
+    """Decoded text of the (possibly still open) "reply" string in partial model output."""
+    m = _REPLY_KEY.search(raw)
+    if not m:
+        return ""
+    out, i = [], m.end()
+    while i < len(raw):
+        c = raw[i]
+        if c == '"':
+            break
+        if c == "\\":
+            if i + 1 >= len(raw):
+                break
+            e = raw[i+1]
+            if e == "u":
+                if i + 6 > len(raw):
+                    break
+                try:
+                    out.append(chr(int(raw[i+2:i+6], 16)))
+                except ValueError:
+                    pass
+                i += 6
+                continue
+            out.append(_ESCAPES.get(e, e))
+            i += 2
+            continue
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+def generate_reply_with_llm(context: Dict[str,Any], user_message: str,
+                            products: List[Dict[str,Any]], interest_score: int) -> Dict[str,Any]:
+    safe_products = _safe_products(products)
+    try:
+        prompt = _reply_prompt(context, user_message, safe_products, interest_score)
+        out = _call_groq(prompt, max_tokens=300, temperature=0.2)
+        return _finish_reply(out)
     except Exception as e:
         LOG.warning("Groq reply failed — fallback. Error: %s", e)
         return _fallback_reply(context, user_message, safe_products, interest_score)
 
+def stream_reply_with_llm(context: Dict[str,Any], user_message: str,
+                          products: List[Dict[str,Any]], interest_score: int) -> Iterator[Tuple[str, Any]]:
+    """Yield ("delta", text) as the reply string is generated, then ("done", reply_obj).
+
+    The model still answers in JSON; only the growing "reply" value is surfaced as deltas.
+    """
+    safe_products = _safe_products(products)
+    raw, sent = "", 0
+    try:
+        if not client:
+            raise RuntimeError("Groq not configured — set GROQ_API_KEY.")
+        stream = client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=[{"role": "user", "content": _reply_prompt(context, user_message, safe_products, interest_score)}],
+            max_completion_tokens=300,
+            temperature=0.2,
+            top_p=1,
+            stream=True
+        )
+        for chunk in stream:
+            raw += chunk.choices[0].delta.content or ""
+            text = _partial_reply(raw)
+            if len(text) > sent:
+                yield "delta", text[sent:]
+                sent = len(text)
+        reply_obj = _finish_reply(raw)
+    except Exception as e:
+        LOG.warning("Groq reply stream failed — fallback. Error: %s", e)
+        if sent:  # the client already shows part of a reply; keep what was streamed
+            reply_obj = {"reply": _partial_reply(raw), "suggested": [], "mention_spice": False, "debug": "stream_interrupted"}
+        else:
+            reply_obj = _fallback_reply(context, user_message, safe_products, interest_score)
+    # whatever the parsed reply adds beyond the streamed prefix (or the whole fallback reply)
+    rest = reply_obj.get("reply", "")
+    if rest.startswith(_partial_reply(raw)[:sent]) and len(rest) > sent:
+        yield "delta", rest[sent:]
+    yield "done", reply_obj
+
 # -------------------
 # Fallbacks
 # -------------------
@@ -0,0 +1,61 @@
+# db.py (shared sqlite connection handling + JSON codec)
+import sqlite3, json, os, threading, queue
+from contextlib import contextmanager
+try:
+    import orjson
+    # sets (e.g. context['seen_intents']) are emitted as lists
+    def dumps(v): return orjson.dumps(v, default=list).decode()
+    loads = orjson.loads
+except ImportError:
+    orjson = None
+    def dumps(v): return json.dumps(v, default=list)
+    loads = json.loads
+PRAGMAS = ('synchronous=NORMAL','temp_store=MEMORY','mmap_size=268435456','cache_size=-64000','busy_timeout=5000')
+READ_POOL_SIZE = int(os.getenv('SQLITE_READ_POOL','4'))
+CACHED_STATEMENTS = 256  # per-connection prepared statement cache (sqlite3 default is 128)
+def _configure(conn):
+    # WAL only applies to file-backed DBs; database_list reports '' for :memory:
+    if conn.execute('PRAGMA database_list').fetchone()[2]: conn.execute('PRAGMA journal_mode=WAL')
+    for p in PRAGMAS: conn.execute(f'PRAGMA {p}')
+    conn.row_factory = sqlite3.Row
+    return conn
+class Database:
+    """One sqlite file: a long-lived autocommit writer (serialized on .lock) plus a pool of read-only handles."""
+    def __init__(self, path, read_pool_size=READ_POOL_SIZE):
+        self.path = path; self.read_pool_size = read_pool_size
+        self.lock = threading.RLock(); self._conn = None; self._read_pool = None
+    def writer(self):
+        # single long-lived autocommit write connection per process; writers serialize on self.lock
+        if self._conn is None:
+            with self.lock:
+                if self._conn is None:
+                    self._conn = _configure(sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=CACHED_STATEMENTS))
+        return self._conn
+    def _readers(self):
+        # read-only handles run concurrently with the writer under WAL; :memory: has no file to share
+        if self._read_pool is None and self.path != ':memory:':
+            with self.lock:
+                if self._read_pool is None:
+                    self.writer()  # writer first so the file exists and is already in WAL mode
+                    pool = queue.Queue()
+                    for _ in range(self.read_pool_size):
+                        pool.put(_configure(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)))
+                    self._read_pool = pool
+        return self._read_pool
+    @contextmanager
+    def reader(self):
+        pool = self._readers()
+        if pool is None:
+            with self.lock: yield self.writer()
+            return
+        conn = pool.get()
+        try: yield conn
+        finally: pool.put(conn)
+    @contextmanager
+    def write_txn(self):
+        # multi-statement writes on the shared autocommit connection need an explicit transaction
+        with self.lock:
+            conn = self.writer(); conn.execute('BEGIN')
+            try: yield conn
+            except BaseException: conn.execute('ROLLBACK'); raise
+            else: conn.execute('COMMIT')
@@ -1,49 +1,108 @@
 # recommender.py (sqlite sync)
-import sqlite3, json, time, os
+import time, os
+from db import Database, dumps as _dumps, loads as _loads
 DB = os.getenv('FOODIE_DB','foodie_products.db')
-def _connect():
-    conn = sqlite3.connect(DB, check_same_thread=False); conn.row_factory = sqlite3.Row; return conn
-def _parse_row(r):
-    d = dict(r)
+_DB = Database(DB)
+_LOCK, _get_conn, _acquire_reader, _write_txn = _DB.lock, _DB.writer, _DB.reader, _DB.write_txn
+PRODUCT_CATEGORY_SQL = 'SELECT category FROM products WHERE product_id=?'
+SIMILAR_PRODUCTS_SQL = 'SELECT * FROM products WHERE category=? AND product_id<>? ORDER BY popularity_score DESC LIMIT ?'
+SEARCH_SQL = 'SELECT p.* FROM products_fts f JOIN products p ON p.id = f.rowid WHERE products_fts MATCH ? ORDER BY f.rank LIMIT ?'
+_TAG_CLAUSE = 'product_id IN (SELECT product_id FROM product_tags WHERE kind=? AND tag=?)'
+def _norm_tags(v):
+    if isinstance(v, str):
+        try: v=_loads(v)
+        except: v=[v]
+    return {str(t).strip().lower() for t in (v or []) if str(t).strip()}
+def sync_product_tags(conn, product_id, mood_tags=None, dietary_tags=None, allergens=None):
+    # keep product_tags in step with the JSON tag columns; call inside _write_txn()
+    conn.execute('DELETE FROM product_tags WHERE product_id=?', (product_id,))
+    rows=[(product_id, kind, t) for kind, v in (('mood',mood_tags),('dietary',dietary_tags),('allergen',allergens)) for t in _norm_tags(v)]
+    conn.executemany('INSERT INTO product_tags (product_id,kind,tag) VALUES (?,?,?)', rows)
+def init_products_db():
+    with _LOCK:
+        conn=_get_conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS product_tags (product_id TEXT NOT NULL, kind TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (product_id, kind, tag))')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_ptags ON product_tags(kind, tag, product_id)')
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='products'").fetchone(): return
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_products_price ON products(price)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_products_pop ON products(popularity_score DESC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_products_cat_pop ON products(category, popularity_score DESC)')
+        # ranking key materialized per write; table_xinfo (not table_info) lists generated columns
+        if not any(c['name']=='base_score' for c in conn.execute('PRAGMA table_xinfo(products)')):
+            conn.execute('ALTER TABLE products ADD COLUMN base_score REAL GENERATED ALWAYS AS (COALESCE(popularity_score,50) - 0.2*COALESCE(price,0)) VIRTUAL')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_products_basescore ON products(base_score DESC)')
+        # external-content FTS5 index over name/description, kept current by triggers
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(name, description, content='products', content_rowid='id')")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END")
+        # rebuild from the JSON columns so edits made outside the API are picked up
+        with _write_txn() as conn:
+            conn.execute('DELETE FROM product_tags')
+            for r in conn.execute('SELECT product_id, mood_tags, dietary_tags, allergens FROM products').fetchall():
+                sync_product_tags(conn, r['product_id'], r['mood_tags'], r['dietary_tags'], r['allergens'])
+            conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+PRODUCT_COLUMNS = ('id','product_id','name','category','description','ingredients','price','calories','prep_time','dietary_tags','mood_tags','allergens','popularity_score','chef_special','limited_time','spice_level','image_url','image_prompt','created_at')
+# list endpoints skip the rarely rendered JSON columns unless asked for them
+LIST_FIELDS = frozenset(PRODUCT_COLUMNS) - {'ingredients','allergens'}
+_ALL_FIELDS = frozenset(PRODUCT_COLUMNS)  # fixed API projection; internal columns (base_score) never leave
+def _parse_row(r, fields=None):
+    # dropping unrequested columns first means their JSON is never decoded
+    fields = _ALL_FIELDS if fields is None else fields & _ALL_FIELDS
+    d = {k: r[k] for k in r.keys() if k in fields}
     for f in ('ingredients','dietary_tags','mood_tags','allergens'):
         if d.get(f) and isinstance(d[f], str):
-            try: d[f]=json.loads(d[f])
+            try: d[f]=_loads(d[f])
             except: pass
     return d
-def fetch_products(where='1=1', params=(), limit=50):
-    sql = f"SELECT * FROM products WHERE {where} LIMIT ?"
-    start=time.time(); conn=_connect(); cur=conn.cursor(); cur.execute(sql, params + (limit,)); rows=[_parse_row(r) for r in cur.fetchall()]; conn.close()
+SCORE_ORDER = 'base_score DESC'  # generated column, see init_products_db
+def fetch_products(where='1=1', params=(), limit=50, order=None, fields=None):
+    sql = f"SELECT * FROM products WHERE {where}{' ORDER BY '+order if order else ''} LIMIT ?"
+    start=time.time()
+    with _acquire_reader() as conn: cur=conn.execute(sql, params + (limit,)); rows=[_parse_row(r, fields) for r in cur.fetchall()]
     return rows
-def recommend_by_preferences(mood=None, budget=None, dietary=None, nutrient=None, limit=10):
+def recommend_by_preferences(mood=None, budget=None, dietary=None, nutrient=None, limit=10, fields=None):
     clauses=[]; params=[]
-    if mood: clauses.append('mood_tags LIKE ?'); params.append(f"%{mood}%")
+    if mood: clauses.append(_TAG_CLAUSE); params += ['mood', str(mood).strip().lower()]
     if budget is not None: clauses.append('price <= ?'); params.append(float(budget))
     if dietary:
-        for d in dietary: clauses.append('dietary_tags LIKE ?'); params.append(f"%{d}%")
+        for d in dietary: clauses.append(_TAG_CLAUSE); params += ['dietary', str(d).strip().lower()]
     if nutrient:
         if nutrient=='protein': clauses.append('calories >= ?'); params.append(300)
         elif nutrient=='low_carb': clauses.append('calories <= ?'); params.append(400)
         elif nutrient=='low_calorie': clauses.append('calories <= ?'); params.append(250)
     where = ' AND '.join(clauses) if clauses else '1=1'
-    rows = fetch_products(where, tuple(params), limit=200)
-    def score(item):
-        s = float(item.get('popularity_score',50))
-        if mood:
-            tags = item.get('mood_tags') or []
-            if isinstance(tags, list) and mood in tags: s+=25
-        if dietary:
-            tags = item.get('dietary_tags') or []; match=0
-            if isinstance(tags,list):
-                for d in dietary:
-                    if d in tags: match+=1
-            s += 12*match
-        if nutrient=='protein' and item.get('calories',0)>=300: s+=10
-        s -= float(item.get('price',0))*0.2
-        return s
-    rows_sorted = sorted(rows, key=score, reverse=True)
-    return rows_sorted[:limit]
+    # the mood (+25), dietary (+12 each) and protein (+10) bonuses hold for every row that passes
+    # the filters above, so ranking reduces to base_score (popularity minus a price penalty)
+    return fetch_products(where, tuple(params), limit=limit, order=SCORE_ORDER, fields=fields)
+def fetch_products_by_ids(product_ids, fields=None):
+    # one IN (...) query for a batch of ids, returned in the order requested
+    ids = list(dict.fromkeys(product_ids))
+    if not ids: return []
+    # product_id is always kept so rows can be matched back to the request order
+    rows = fetch_products(f"product_id IN ({','.join('?'*len(ids))})", tuple(ids), limit=len(ids), fields=None if fields is None else fields | {'product_id'})
+    by_id = {r['product_id']: r for r in rows}
+    return [by_id[i] for i in ids if i in by_id]
+def search_products(q, limit=10, fields=None):
+    # each word becomes a quoted prefix term so user input can't break FTS5 query syntax
+    match = ' '.join('"%s"*' % w.replace('"','""') for w in q.split())
+    if not match: return []
+    with _acquire_reader() as conn: cur=conn.execute(SEARCH_SQL, (match, limit)); return [_parse_row(r, fields) for r in cur.fetchall()]
+def matches_preferences(item, mood=None, budget=None, dietary=None, nutrient=None):
+    # Python twin of the WHERE clauses in recommend_by_preferences, for filtering an already-ranked list
+    if mood and str(mood).strip().lower() not in _norm_tags(item.get('mood_tags')): return False
+    if budget is not None and (item.get('price') is None or item['price'] > float(budget)): return False
+    if dietary:
+        tags=_norm_tags(item.get('dietary_tags'))
+        if any(str(d).strip().lower() not in tags for d in dietary): return False
+    cal=item.get('calories')
+    if nutrient=='protein' and (cal is None or cal < 300): return False
+    if nutrient=='low_carb' and (cal is None or cal > 400): return False
+    if nutrient=='low_calorie' and (cal is None or cal > 250): return False
+    return True
 def collaborative_recommend(product_id, limit=5):
-    conn=_connect(); cur=conn.cursor(); cur.execute('SELECT category FROM products WHERE product_id=?',(product_id,)); r=cur.fetchone()
-    if not r: conn.close(); return []
-    category=r['category']; cur.execute('SELECT * FROM products WHERE category=? AND product_id<>? ORDER BY popularity_score DESC LIMIT ?',(category,product_id,limit))
-    rows=[_parse_row(rr) for rr in cur.fetchall()]; conn.close(); return rows
+    with _acquire_reader() as conn:
+        cur=conn.cursor(); cur.execute(PRODUCT_CATEGORY_SQL,(product_id,)); r=cur.fetchone()
+        if not r: return []
+        category=r['category']; cur.execute(SIMILAR_PRODUCTS_SQL,(category,product_id,limit))
+        return [_parse_row(rr) for rr in cur.fetchall()]
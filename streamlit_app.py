@@ -1,11 +1,23 @@
 # streamlit_app.py
+import base64
+import html
+import io
+import json
 import os
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Dict, Any
 
 import streamlit as st
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # -----------------------
 # Configuration: API base resolution
@@ -28,6 +40,38 @@ def get_api_base():
 
 API_BASE = get_api_base()
 
+@st.cache_resource
+def get_client() -> requests.Session:
+    """
+    One keep-alive connection pool for the whole app.
+    Cached as a resource so it survives reruns and is shared by every browser session
+    (a module-level Session would be rebuilt, and its sockets dropped, on each rerun).
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+SESSION = get_client()
+
+# orjson (C codec) for request bodies and responses when installed, stdlib json otherwise
+JSON_HEADERS = {"Content-Type": "application/json"}
+if orjson:
+    _json_loads, _dumps = orjson.loads, orjson.dumps
+else:
+    _json_loads = json.loads
+    def _dumps(v): return json.dumps(v).encode()
+
+def _loads(body):
+    # re-raise as requests' JSONDecodeError (a RequestException, like r.json()) so the helpers'
+    # error handlers still catch non-JSON bodies, e.g. an HTML 200 from a proxy
+    try:
+        return _json_loads(body)
+    except ValueError as e:
+        doc = body if isinstance(body, str) else bytes(body).decode("utf-8", "replace")
+        raise requests.exceptions.JSONDecodeError(str(e), doc, 0) from e
+
 # -----------------------
 # Page config
 # -----------------------
@@ -37,14 +81,14 @@ st.title("🍔 FoodieBot — Demo (Full)")
 # -----------------------
 # Session state initialization
 # -----------------------
-if "history" not in st.session_state:
-    st.session_state.history: List[Dict[str, Any]] = []  # list of dicts {who, text, score, debug, ts}
-if "session_id" not in st.session_state:
-    st.session_state.session_id: Optional[str] = None
-if "cart" not in st.session_state:
-    st.session_state.cart: List[str] = []
-if "suggested_products" not in st.session_state:
-    st.session_state.suggested_products: List[Dict[str, Any]] = []
+MAX_HISTORY = 200  # chat entries kept in session state (oldest dropped first)
+st.session_state.setdefault("history", [])  # list of dicts {who, text, score, debug, ts}
+st.session_state.setdefault("session_id", None)
+st.session_state.setdefault("cart", [])
+st.session_state.setdefault("suggested_products", [])
+st.session_state.setdefault("chat_pending", None)  # {"text", "id"} of a message sent but not yet answered
+st.session_state.setdefault("admin_query", "")  # last Admin search term
+st.session_state.setdefault("editing_pid", None)  # product open in the Admin edit form
 
 # -----------------------
 # Small helpers for API
@@ -52,19 +96,58 @@ if "suggested_products" not in st.session_state:
 def api_post(path: str, json_payload: dict = None, timeout: int = 10):
     url = f"{API_BASE}{path}"
     try:
-        r = requests.post(url, json=json_payload, timeout=timeout)
+        r = SESSION.post(url, data=None if json_payload is None else _dumps(json_payload), headers=JSON_HEADERS, timeout=timeout)
         r.raise_for_status()
-        return r.json()
+        st.cache_data.clear()  # a write may change any cached listing
+        return _loads(r.content)
     except requests.exceptions.RequestException as e:
         st.error(f"API POST error {url}: {e}")
         return None
 
-def api_get(path: str, params: dict = None, timeout: int = 10):
+def api_put(path: str, json_payload: dict = None, timeout: int = 10, retries: int = 2):
+    # PUT is idempotent, so connection errors and 5xx are retried with exponential backoff (0.2s, 0.4s, ...)
     url = f"{API_BASE}{path}"
+    for attempt in range(retries + 1):
+        try:
+            r = SESSION.put(url, data=None if json_payload is None else _dumps(json_payload), headers=JSON_HEADERS, timeout=timeout)
+            r.raise_for_status()
+            st.cache_data.clear()  # a write may change any cached listing
+            return _loads(r.content)
+        except requests.exceptions.RequestException as e:
+            status = getattr(e.response, "status_code", None)
+            if attempt == retries or (status is not None and status < 500):
+                st.error(f"API PUT error {url}: {e}")
+                return None
+            time.sleep(0.2 * (2 ** attempt))
+
+def _http_get(url: str, params_tuple: tuple, timeout: int):
+    r = SESSION.get(url, params=dict(params_tuple), timeout=timeout)
+    r.raise_for_status()
+    return _loads(r.content)
+
+# reruns with unchanged inputs are served from these instead of the network;
+# exceptions are not cached, so failures are retried on the next rerun
+@st.cache_data(ttl=30, max_entries=256, show_spinner=False)
+def _cached_get(url: str, params_tuple: tuple, timeout: int):
+    return _http_get(url, params_tuple, timeout)
+
+@st.cache_data(ttl=300, max_entries=512, show_spinner=False)
+def _cached_get_long(url: str, params_tuple: tuple, timeout: int):
+    return _http_get(url, params_tuple, timeout)
+
+def api_get(path: str, params: dict = None, timeout: int = 10, cache: Optional[str] = "short"):
+    """
+    GET helper. cache="short" keeps responses for 30s, "long" for 300s (product details),
+    None always hits the API (session-dependent endpoints).
+    """
+    url = f"{API_BASE}{path}"
+    params_tuple = tuple(sorted((params or {}).items()))
     try:
-        r = requests.get(url, params=params, timeout=timeout)
-        r.raise_for_status()
-        return r.json()
+        if cache == "long":
+            return _cached_get_long(url, params_tuple, timeout)
+        if cache == "short":
+            return _cached_get(url, params_tuple, timeout)
+        return _http_get(url, params_tuple, timeout)
     except requests.exceptions.RequestException as e:
         st.error(f"API GET error {url}: {e}")
         return None
@@ -72,17 +155,141 @@ def api_get(path: str, params: dict = None, timeout: int = 10):
 def api_delete(path: str, timeout: int = 10):
     url = f"{API_BASE}{path}"
     try:
-        r = requests.delete(url, timeout=timeout)
+        r = SESSION.delete(url, timeout=timeout)
         r.raise_for_status()
-        return r.json() if r.text else {"status":"deleted"}
+        st.cache_data.clear()
+        return _loads(r.content) if r.content else {"status":"deleted"}
     except requests.exceptions.RequestException as e:
         st.error(f"API DELETE error {url}: {e}")
         return None
 
+def fetch_products_parallel(product_ids: List[str], timeout: int = 10) -> List[Dict[str, Any]]:
+    """
+    Fetches /product/{id} for each id concurrently over the pooled session.
+    Runs off the script thread, so failures are skipped rather than reported via st.error.
+    """
+    def _fetch(pid):
+        try:
+            r = SESSION.get(f"{API_BASE}/product/{pid}", timeout=timeout)
+            r.raise_for_status()
+            return _loads(r.content)
+        except requests.exceptions.RequestException:
+            return None
+    if not product_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=min(8, len(product_ids))) as pool:
+        return [p for p in pool.map(_fetch, product_ids) if p]
+
+def fetch_products_batch(product_ids: List[str], timeout: int = 10) -> List[Dict[str, Any]]:
+    """
+    Fetches several products with a single /products?ids= call.
+    Falls back to per-id fetches when the backend predates that endpoint (404).
+    """
+    if not product_ids:
+        return []
+    url = f"{API_BASE}/products"
+    try:
+        r = SESSION.get(url, params={"ids": ",".join(map(str, product_ids))}, timeout=timeout)
+        if r.status_code == 404:
+            return fetch_products_parallel(product_ids, timeout=timeout)
+        r.raise_for_status()
+        return _loads(r.content).get("results", [])
+    except requests.exceptions.RequestException as e:
+        st.error(f"API GET error {url}: {e}")
+        return []
+
+@st.cache_resource(max_entries=512, show_spinner=False)
+def _load_thumb(url: str, w: int = 320):
+    """
+    Downloads and downsizes a product image once; the decoded PIL image is shared across
+    sessions and reruns. Raises if the image can't be fetched or decoded, so failures are
+    not cached and callers fall back to the raw URL.
+    """
+    r = SESSION.get(url, timeout=5)
+    r.raise_for_status()
+    img = Image.open(io.BytesIO(r.content)).convert("RGB")
+    img.thumbnail((w, w * 200 // 320))
+    return img
+
+def _image_url(item: Dict[str, Any]) -> str:
+    pid = item.get("product_id") or item.get("id") or ""
+    return item.get("image_url") or item.get("image") or f"https://picsum.photos/seed/{pid}/320/200"
+
+@st.cache_resource(max_entries=512, show_spinner=False)
+def _thumb_data_uri(url: str) -> str:
+    """
+    The cached _load_thumb thumbnail as a JPEG data URI, so static HTML cards embed the
+    downsized image instead of making the browser fetch the full-size one. Raises on failure.
+    """
+    buf = io.BytesIO()
+    _load_thumb(url).save(buf, format="JPEG", quality=80)
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode()
+
+def _has_thumb(url: str) -> bool:
+    try:
+        _thumb_data_uri(url)
+        return True
+    except Exception:
+        return False
+
+def card_html(item: Dict[str, Any], inline_thumb: bool = False) -> str:
+    """
+    Static HTML for a product card (no widgets), for rendering long result lists in one call.
+    With inline_thumb the cached thumbnail is embedded; otherwise the image URL is linked.
+    """
+    name = html.escape(str(item.get("name") or "Unnamed"))
+    price = float(item.get("price") or 0.0)
+    url = _image_url(item)
+    img = _thumb_data_uri(url) if inline_thumb else html.escape(str(url), quote=True)
+    lines = []
+    if item.get("description"):
+        lines.append(html.escape(str(item["description"])))
+    if item.get("category"):
+        lines.append("<b>Category:</b> " + html.escape(str(item["category"])))
+    if item.get("mood_tags"):
+        lines.append("Mood: " + html.escape(", ".join(map(str, item["mood_tags"]))))
+    if item.get("dietary_tags"):
+        lines.append("Dietary: " + html.escape(", ".join(map(str, item["dietary_tags"]))))
+    if item.get("spice_level") is not None:
+        lines.append(f"Spice: {item['spice_level']}/10")
+    lines.append(f"Popularity: {html.escape(str(item.get('popularity_score', 'N/A')))}")
+    return (
+        "<div style='display:flex;gap:1rem;margin-bottom:0.75rem'>"
+        f"<img src='{img}' loading='lazy' style='width:33%;max-width:320px;object-fit:cover'/>"
+        f"<div><h4>{name} — ${price:.2f}</h4>" + "<br/>".join(lines) + "</div></div><hr/>"
+    )
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def _cached_card_html(item_items: tuple, inline_thumb: bool) -> str:
+    return card_html(dict(item_items), inline_thumb)
+
+def cached_card_html(item: Dict[str, Any]) -> str:
+    """
+    card_html memoized on the product's content (sorted key/value pairs), so unchanged cards
+    aren't rebuilt on every rerun; an edited product hashes differently and is re-rendered.
+    Whether the thumbnail loaded is part of the key, so a failed download isn't pinned.
+    """
+    return _cached_card_html(tuple(sorted(item.items())), _has_thumb(_image_url(item)))
+
+def show_product_cards(items: List[Dict[str, Any]]):
+    """
+    Renders a list of products as one markdown block instead of a widget tree per card.
+    """
+    # warm the thumbnail cache in parallel; the cards below then hit it
+    urls = list(dict.fromkeys(_image_url(it) for it in items))
+    if urls:
+        with ThreadPoolExecutor(max_workers=min(8, len(urls))) as pool:
+            list(pool.map(_has_thumb, urls))
+    st.markdown("<div class='cards'>" + "".join(cached_card_html(it) for it in items) + "</div>", unsafe_allow_html=True)
+
 def show_product_card(item: Dict[str, Any], show_actions: bool = True):
     """
     Renders a product card with image, description, tags and action buttons.
+    With show_actions=False the card is a single static HTML block (see show_product_cards).
     """
+    if not show_actions:
+        st.markdown(cached_card_html(item), unsafe_allow_html=True)
+        return
     name = item.get("name") or "Unnamed"
     price = float(item.get("price") or 0.0)
     desc = item.get("description") or ""
@@ -95,7 +302,11 @@ def show_product_card(item: Dict[str, Any], show_actions: bool = True):
     cols = st.columns([1, 2])
     with cols[0]:
         try:
-            st.image(img, use_column_width=True)
+            thumb = _load_thumb(img)
+        except Exception:
+            thumb = img  # not cached, so the thumbnail is retried on the next render
+        try:
+            st.image(thumb, use_column_width=True)
         except Exception:
             st.write("No image")
     with cols[1]:
@@ -112,26 +323,142 @@ def show_product_card(item: Dict[str, Any], show_actions: bool = True):
         if spice is not None:
             st.write(f"Spice: {spice}/10")
         st.write(f"Popularity: {item.get('popularity_score','N/A')}")
-        if show_actions:
-            a1, a2, a3 = st.columns([1, 1, 1])
-            with a1:
-                if st.button("Add to cart", key=f"add_{pid}"):
-                    st.session_state.cart.append(pid)
-                    st.success(f"Added {name} to cart (demo).")
-            with a2:
-                if st.button("View details", key=f"view_{pid}"):
-                    details = api_get(f"/product/{pid}")
-                    if details:
-                        st.json(details)
-            with a3:
-                if st.button("Recommend similar", key=f"sim_{pid}"):
-                    res = api_get("/collab", params={"product_id": pid, "limit": 6})
-                    if res and res.get("results"):
-                        st.write("Similar recommendations:")
-                        for r in res.get("results", []):
-                            st.markdown(f"- **{r.get('name')}** — ${r.get('price')}")
+        pid_str = str(pid)
+        a1, a2, a3 = st.columns([1, 1, 1])
+        with a1:
+            if st.button("Add to cart", key="add_" + pid_str):
+                st.session_state.cart.append(pid)
+                st.success(f"Added {name} to cart (demo).")
+        with a2:
+            if st.button("View details", key="view_" + pid_str):
+                details = api_get(f"/product/{pid}", cache="long")
+                if details:
+                    st.json(details)
+        with a3:
+            if st.button("Recommend similar", key="sim_" + pid_str):
+                res = api_get("/collab", params={"product_id": pid, "limit": 6})
+                if res and res.get("results"):
+                    st.write("Similar recommendations:")
+                    for r in res.get("results", []):
+                        st.markdown(f"- **{r.get('name')}** — ${r.get('price')}")
     st.markdown("---")
 
+def stream_chat(payload, placeholder):
+    """
+    POST /chat asking for a streamed reply.
+    Reply deltas are rendered into `placeholder` as they arrive; returns the final
+    response dict (same shape as the JSON body, which is used as-is if the backend doesn't stream).
+    """
+    data = {}
+    with SESSION.post(f"{API_BASE}/chat", data=_dumps({**payload, "stream": True}), headers=JSON_HEADERS, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        if r.headers.get("Content-Type", "").startswith("application/json"):
+            return _loads(r.content)
+        text = ""
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            event = _loads(line[5:])
+            if event.get("type") == "delta":
+                text += event.get("text", "")
+                placeholder.markdown(f"**🤖 Bot:** {text}")
+            elif event.get("type") == "done":
+                data = event
+    placeholder.empty()  # the finished reply is rendered from history below
+    if not data:
+        raise RuntimeError("chat stream ended before the reply completed")
+    return data
+
+# -----------------------
+# Analytics helpers
+# -----------------------
+# st.fragment reruns only the decorated block on widget interaction (older Streamlit: no-op)
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
+# columns shown on the Analytics page; the backend returns them newest first
+CONVERSATION_FIELDS = "id,session_id,turn,user_message,bot_reply,interest_score,created_at"
+
+@st.cache_data(ttl=15, show_spinner=False)
+def _load_analytics():
+    return (
+        api_get("/analytics/conversations", params={"limit": 500, "order": "id.desc", "fields": CONVERSATION_FIELDS}, cache=None),
+        api_get("/analytics/recent_queries", params={"limit": 300}, cache=None),
+    )
+
+CONVERSATION_DTYPES = {"id": "Int32", "turn": "Int16", "interest_score": "float32", "session_id": "category"}
+
+@st.cache_data(ttl=15, show_spinner=False)
+def _conversations_frame(n_rows: int, first_id, _conversations: List[Dict[str, Any]]):
+    import pandas as pd
+    # fixed schema, so skip per-row dict inference; keyed on row count + newest id
+    df = pd.DataFrame.from_records(_conversations, columns=CONVERSATION_FIELDS.split(","))
+    return df.astype(CONVERSATION_DTYPES)
+
+SCORE_BINS = (-1, 20, 40, 60, 80, 100)
+SCORE_LABELS = ["0-20", "21-40", "41-60", "61-80", "81-100"]
+
+@st.cache_data(ttl=15, show_spinner=False)
+def _score_bins(n_rows: int, last_id, _scores):
+    import numpy as np
+    import pandas as pd
+    # keyed on row count + newest id, so the bins are only recomputed when new turns are logged;
+    # same right-closed bins as pd.cut, out-of-range scores are dropped
+    idx = np.searchsorted(np.asarray(SCORE_BINS, dtype="float32"), _scores, side="left") - 1
+    idx = idx[(idx >= 0) & (idx < len(SCORE_LABELS))]
+    return pd.Series(np.bincount(idx, minlength=len(SCORE_LABELS)), index=SCORE_LABELS)
+
+@_fragment
+def _session_chart(df):
+    sel = st.selectbox("Pick session to visualize", [""] + df["session_id"].cat.categories.tolist())
+    if sel:
+        s_df = df[df["session_id"] == sel].sort_values("turn", ascending=True)
+        if "interest_score" in s_df.columns:
+            st.line_chart(s_df.set_index("turn")["interest_score"])
+
+# -----------------------
+# Admin helpers
+# -----------------------
+def render_edit_form(pid: str):
+    """
+    Renders the edit form for the product being edited (st.session_state.editing_pid).
+    Only one form exists at a time; Save PUTs the full product, Cancel closes the form.
+    """
+    it = api_get(f"/product/{pid}", cache=None)
+    if not it:
+        st.session_state.editing_pid = None
+        return
+    st.markdown(f"#### Editing {it.get('name')} (`{pid}`)")
+    with st.form("edit_form"):
+        new_name = st.text_input("Name", value=it.get("name"))
+        new_cat = st.text_input("Category", value=it.get("category") or "")
+        new_price = st.number_input("Price", value=float(it.get("price") or 0.0))
+        new_desc = st.text_area("Description", value=it.get("description") or "")
+        save, cancel = st.columns([1, 1])
+        submit_edit = save.form_submit_button("Save")
+        cancel_edit = cancel.form_submit_button("Cancel")
+    if cancel_edit:
+        st.session_state.editing_pid = None
+        st.rerun()
+    if submit_edit:
+        payload = {
+            "name": new_name,
+            "category": new_cat,
+            "price": float(new_price),
+            "description": new_desc,
+            "ingredients": it.get("ingredients") or [],
+            "dietary_tags": it.get("dietary_tags") or [],
+            "mood_tags": it.get("mood_tags") or [],
+            "allergens": it.get("allergens") or [],
+            "popularity_score": it.get("popularity_score", 50),
+            "chef_special": it.get("chef_special", False),
+            "limited_time": it.get("limited_time", False),
+            "spice_level": it.get("spice_level", 0),
+            "image_url": it.get("image_url")
+        }
+        if api_put(f"/admin/products/{pid}", json_payload=payload):
+            st.session_state.editing_pid = None
+            st.success("Updated product.")
+
 # -----------------------
 # Sidebar navigation (keeps your existing chat as default)
 # -----------------------
@@ -151,10 +478,15 @@ if page == "Chat (default)":
                 payload = {"message": user_input}
                 if st.session_state.session_id:
                     payload["session_id"] = st.session_state.session_id
+                # Streamlit runs one script run per session at a time, so duplicates come from a click
+                # interrupting an outstanding request; resending the same unanswered text reuses its id
+                # and the backend returns the first reply instead of generating another
+                pending = st.session_state.chat_pending
+                if not pending or pending["text"] != user_input:
+                    pending = st.session_state.chat_pending = {"text": user_input, "id": uuid.uuid4().hex}
+                payload["client_request_id"] = pending["id"]
                 try:
-                    resp = requests.post(f"{API_BASE}/chat", json=payload, timeout=8)
-                    resp.raise_for_status()
-                    data = resp.json()
+                    data = stream_chat(payload, st.empty())
                     # store session id
                     st.session_state.session_id = data.get("session_id")
                     # append to history
@@ -166,21 +498,19 @@ if page == "Chat (default)":
                         "debug": data.get("debug",""),
                         "ts":time.time()
                     })
+                    del st.session_state.history[:-MAX_HISTORY]
                     # if suggested product ids included, fetch product details
                     suggested_ids = data.get("suggested") or []
                     if suggested_ids:
-                        st.session_state.suggested_products = []
-                        for pid in suggested_ids:
-                            p = api_get(f"/product/{pid}")
-                            if p:
-                                st.session_state.suggested_products.append(p)
+                        st.session_state.suggested_products = fetch_products_batch(suggested_ids)
+                    st.session_state.chat_pending = None
                 except Exception as e:
                     st.error(f"API error: {e}")
 
         # Render history (newest first)
         if st.session_state.history:
             st.subheader("Conversation history")
-            for msg in st.session_state.history[::-1]:
+            for msg in reversed(st.session_state.history):
                 if msg["who"] == "You":
                     st.markdown(f"**🧑 You:** {msg['text']}")
                 else:
@@ -209,15 +539,14 @@ if page == "Chat (default)":
         if st.button("Get Recommendations", key="recs_btn_right"):
             try:
                 params = {"mood": mood or None, "budget": budget, "limit": limit}
-                resp = requests.get(f"{API_BASE}/recommend", params=params, timeout=8)
+                resp = SESSION.get(f"{API_BASE}/recommend", params=params, timeout=8)
                 resp.raise_for_status()
-                data = resp.json()
+                data = _loads(resp.content)
                 results = data.get("results", [])
                 if not results:
                     st.info("No recommendations found for that filter.")
                 else:
-                    for item in results:
-                        show_product_card(item)
+                    show_product_cards(results)
             except Exception as e:
                 st.error(f"Recommendation API error: {e}")
 
@@ -228,11 +557,10 @@ if page == "Chat (default)":
             if not st.session_state.session_id:
                 st.warning("Start a conversation to create a session first.")
             else:
-                res = api_get("/recommend_from_context", params={"session_id": st.session_state.session_id, "limit": 6})
+                res = api_get("/recommend_from_context", params={"session_id": st.session_state.session_id, "limit": 6}, cache=None)
                 if res and res.get("results"):
                     st.success("Recommendations from session:")
-                    for it in res.get("results", []):
-                        show_product_card(it)
+                    show_product_cards(res.get("results", []))
         if st.button("Clear session data"):
             st.session_state.session_id = None
             st.session_state.history = []
@@ -267,8 +595,7 @@ elif page == "Recommendations":
             if not results:
                 st.info("No recommendations for that filter.")
             else:
-                for it in results:
-                    show_product_card(it)
+                show_product_cards(results)
 
     st.markdown("---")
     st.subheader("Search products")
@@ -279,33 +606,27 @@ elif page == "Recommendations":
         else:
             out = api_get("/search", params={"q": q, "limit": 20})
             if out:
-                for it in out.get("results", []):
-                    show_product_card(it)
+                show_product_cards(out.get("results", []))
 
 # -----------------------
 # Analytics page
 # -----------------------
 elif page == "Analytics":
+    # pandas is only needed here; importing it lazily keeps it off the Chat/Admin/Docs cold start
+    import pandas as pd
     st.header("📊 Analytics & Insights")
     st.subheader("Recent Conversations")
-    conversations = api_get("/analytics/conversations", params={"limit": 500})
+    conversations, queries = _load_analytics()
     if conversations:
-        df = pd.DataFrame(conversations)
+        df = _conversations_frame(len(conversations), conversations[0].get("id"), conversations)
         if df.empty:
             st.info("No conversation logs yet.")
         else:
-            # show key columns if present
-            show_cols = [c for c in ["id","session_id","turn","user_message","bot_reply","interest_score","created_at"] if c in df.columns]
-            st.dataframe(df[show_cols].sort_values(by="id", ascending=False).reset_index(drop=True), height=300)
+            st.dataframe(df, height=300)
             if "session_id" in df.columns:
-                sel = st.selectbox("Pick session to visualize", [""] + df["session_id"].dropna().unique().tolist())
-                if sel:
-                    s_df = df[df["session_id"] == sel].sort_values("turn", ascending=True)
-                    if "interest_score" in s_df.columns:
-                        st.line_chart(s_df.set_index("turn")["interest_score"])
+                _session_chart(df)
     st.markdown("---")
     st.subheader("Recent DB queries")
-    queries = api_get("/analytics/recent_queries", params={"limit":300})
     if queries:
         qdf = pd.DataFrame(queries)
         if not qdf.empty:
@@ -316,10 +637,9 @@ elif page == "Analytics":
     st.subheader("Quick recommendation performance")
     if conversations:
         try:
-            df2 = df.copy()
-            if "interest_score" in df2.columns:
-                df2["score_bin"] = pd.cut(df2["interest_score"].fillna(0), bins=[-1,20,40,60,80,100], labels=["0-20","21-40","41-60","61-80","81-100"])
-                bin_counts = df2.groupby("score_bin").size()
+            if "interest_score" in df.columns:
+                scores = df["interest_score"].to_numpy(dtype="float32", na_value=0.0)
+                bin_counts = _score_bins(len(df), df["id"].max() if "id" in df.columns else None, scores)
                 st.bar_chart(bin_counts)
         except Exception as e:
             st.warning(f"Could not compute quick metrics: {e}")
@@ -360,48 +680,29 @@ elif page == "Admin":
         if not q.strip():
             st.warning("Type a search keyword.")
         else:
-            out = api_get("/search", params={"q": q, "limit": 50})
-            if out:
-                for it in out.get("results", []):
-                    st.markdown(f"**{it.get('name')}** — ${it.get('price')}")
-                    st.write(it.get("description"))
-                    colA, colB = st.columns([1,3])
-                    with colA:
-                        if st.button("Delete", key=f"del_{it.get('product_id')}"):
-                            d = api_delete(f"/admin/products/{it.get('product_id')}")
-                            if d:
-                                st.success("Deleted.")
-                    with colB:
-                        if st.button("Edit", key=f"edit_{it.get('product_id')}"):
-                            # inline editor form
-                            with st.form(f"edit_form_{it.get('product_id')}"):
-                                new_name = st.text_input("Name", value=it.get("name"))
-                                new_cat = st.text_input("Category", value=it.get("category") or "")
-                                new_price = st.number_input("Price", value=float(it.get("price") or 0.0))
-                                new_desc = st.text_area("Description", value=it.get("description") or "")
-                                submit_edit = st.form_submit_button("Save")
-                                if submit_edit:
-                                    payload = {
-                                        "name": new_name,
-                                        "category": new_cat,
-                                        "price": float(new_price),
-                                        "description": new_desc,
-                                        "ingredients": it.get("ingredients") or [],
-                                        "dietary_tags": it.get("dietary_tags") or [],
-                                        "mood_tags": it.get("mood_tags") or [],
-                                        "allergens": it.get("allergens") or [],
-                                        "popularity_score": it.get("popularity_score", 50),
-                                        "chef_special": it.get("chef_special", False),
-                                        "limited_time": it.get("limited_time", False),
-                                        "spice_level": it.get("spice_level", 0),
-                                        "image_url": it.get("image_url")
-                                    }
-                                    upd = requests.put(f"{API_BASE}/admin/products/{it.get('product_id')}", json=payload)
-                                    if upd.status_code == 200:
-                                        st.success("Updated product.")
-                                    else:
-                                        st.error(f"Update failed: {upd.text}")
-                    st.markdown("---")
+            # kept in session state so the Delete/Edit buttons below still exist on the rerun their click triggers
+            st.session_state.admin_query = q.strip()
+            st.session_state.editing_pid = None
+    if st.session_state.editing_pid:
+        render_edit_form(st.session_state.editing_pid)
+    if st.session_state.admin_query:
+        out = api_get("/search", params={"q": st.session_state.admin_query, "limit": 50})
+        if out:
+            for it in out.get("results", []):
+                pid_str = str(it.get("product_id"))
+                st.markdown(f"**{it.get('name')}** — ${it.get('price')}")
+                st.write(it.get("description"))
+                colA, colB = st.columns([1,3])
+                with colA:
+                    if st.button("Delete", key="del_" + pid_str):
+                        d = api_delete(f"/admin/products/{pid_str}")
+                        if d:
+                            st.success("Deleted.")
+                with colB:
+                    if st.button("Edit", key="edit_" + pid_str):
+                        st.session_state.editing_pid = pid_str
+                        st.rerun()
+                st.markdown("---")
 
 # -----------------------
 # Docs & quick tests